@@ -1,13 +1,21 @@
 import logging
 import asyncio
 import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, NamedTuple, Tuple
 from pathlib import Path
 
 from settings import settings
 
 
+class UserStats(NamedTuple):
+    """Статистика пользователя"""
+    downloads: int = 0
+    registration_date: str = 'Неизвестно'
+    last_activity: str = 'Сейчас'
+
+
 class DatabaseManager:
     """Класс для управления базой данных"""
     
@@ -16,17 +24,50 @@ class DatabaseManager:
         self.db_path = "data/bot.db"
         self._ensure_data_directory()
         
-        # Создаем таблицы при инициализации
-        asyncio.create_task(self._init_database())
+        # Пул долгоживущих соединений вместо открытия нового на каждый запрос
+        self.pool = SQLiteConnectionPool(self._connection_factory)
+        
+        # SQLite допускает только одного писателя: запись сериализуется здесь,
+        # чтобы ожидающие записи не удерживали соединения пула
+        self._write_lock = asyncio.Lock()
+        
+        # Схема создается один раз через ensure_initialized()
+        self._init_event = asyncio.Event()
+        self._init_started = False
     
     def _ensure_data_directory(self):
         """Создает директорию для базы данных если она не существует"""
         Path("data").mkdir(exist_ok=True)
     
+    async def _connection_factory(self) -> aiosqlite.Connection:
+        """Создает новое соединение для пула и настраивает его"""
+        conn = await aiosqlite.connect(self.db_path)
+        # WAL убирает fsync на каждый commit и не блокирует читателей;
+        # остальные PRAGMA действуют только в рамках соединения
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA wal_autocheckpoint=1000")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA cache_size=-4000")
+        return conn
+    
+    async def ensure_initialized(self):
+        """Инициализирует базу данных один раз; повторные вызовы ждут завершения"""
+        if self._init_started:
+            await self._init_event.wait()
+            return
+        
+        self._init_started = True
+        try:
+            await self._init_database()
+        finally:
+            self._init_event.set()
+    
     async def _init_database(self):
         """Инициализирует базу данных и создает таблицы"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write_lock, self.pool.connection() as db:
                 # Таблица пользователей
                 await db.execute("""
                     CREATE TABLE IF NOT EXISTS users (
@@ -55,6 +96,17 @@ class DatabaseManager:
                     )
                 """)
                 
+                # Кэш уже загруженных в Telegram аудио по ID видео
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS cached_files (
+                        video_id TEXT PRIMARY KEY,
+                        telegram_file_id TEXT NOT NULL,
+                        video_title TEXT,
+                        file_size INTEGER,
+                        cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
                 # Индексы для оптимизации
                 await db.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON downloads(user_id)")
                 await db.execute("CREATE INDEX IF NOT EXISTS idx_download_date ON downloads(download_date)")
@@ -69,24 +121,17 @@ class DatabaseManager:
                       first_name: Optional[str] = None, last_name: Optional[str] = None):
         """Добавляет нового пользователя или обновляет существующего"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Проверяем, существует ли пользователь
-                cursor = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                user_exists = await cursor.fetchone()
-                
-                if user_exists:
-                    # Обновляем последнюю активность и данные пользователя
-                    await db.execute("""
-                        UPDATE users 
-                        SET username = ?, first_name = ?, last_name = ?, last_activity = CURRENT_TIMESTAMP
-                        WHERE user_id = ?
-                    """, (username, first_name, last_name, user_id))
-                else:
-                    # Добавляем нового пользователя
-                    await db.execute("""
-                        INSERT INTO users (user_id, username, first_name, last_name)
-                        VALUES (?, ?, ?, ?)
-                    """, (user_id, username, first_name, last_name))
+            async with self._write_lock, self.pool.connection() as db:
+                # Добавляем нового пользователя или обновляем данные существующего
+                await db.execute("""
+                    INSERT INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        last_activity = CURRENT_TIMESTAMP
+                """, (user_id, username, first_name, last_name))
                 
                 await db.commit()
                 self.logger.info(f"Пользователь {user_id} добавлен/обновлен в базе данных")
@@ -94,10 +139,10 @@ class DatabaseManager:
         except Exception as e:
             self.logger.error(f"Ошибка при добавлении пользователя {user_id}: {e}")
     
-    async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
+    async def get_user_stats(self, user_id: int) -> UserStats:
         """Получает статистику пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.connection() as db:
                 # Получаем основную информацию о пользователе
                 cursor = await db.execute("""
                     SELECT registration_date, last_activity, downloads_count 
@@ -107,28 +152,20 @@ class DatabaseManager:
                 user_data = await cursor.fetchone()
                 
                 if not user_data:
-                    return {
-                        'downloads': 0,
-                        'registration_date': 'Неизвестно',
-                        'last_activity': 'Сейчас'
-                    }
+                    return UserStats()
                 
                 reg_date, last_activity, downloads_count = user_data
                 
-                return {
-                    'downloads': downloads_count or 0,
-                    'registration_date': reg_date,
-                    'last_activity': last_activity
-                }
+                return UserStats(downloads_count or 0, reg_date, last_activity)
                 
         except Exception as e:
             self.logger.error(f"Ошибка при получении статистики пользователя {user_id}: {e}")
-            return {'downloads': 0, 'registration_date': 'Неизвестно', 'last_activity': 'Сейчас'}
+            return UserStats()
     
     async def increment_user_downloads(self, user_id: int):
         """Увеличивает счетчик загрузок пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write_lock, self.pool.connection() as db:
                 await db.execute("""
                     UPDATE users 
                     SET downloads_count = downloads_count + 1, last_activity = CURRENT_TIMESTAMP
@@ -145,7 +182,7 @@ class DatabaseManager:
                           file_size: int, success: bool = True):
         """Логирует информацию о загрузке"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write_lock, self.pool.connection() as db:
                 await db.execute("""
                     INSERT INTO downloads (user_id, youtube_url, video_title, file_size, success)
                     VALUES (?, ?, ?, ?, ?)
@@ -157,10 +194,70 @@ class DatabaseManager:
         except Exception as e:
             self.logger.error(f"Ошибка при записи загрузки в базу данных: {e}")
     
+    async def record_successful_download(self, user_id: int, youtube_url: str,
+                                         video_title: Optional[str], file_size: int):
+        """Записывает успешную загрузку и увеличивает счетчик пользователя одной транзакцией"""
+        try:
+            async with self._write_lock, self.pool.connection() as db:
+                await db.execute("""
+                    INSERT INTO downloads (user_id, youtube_url, video_title, file_size, success)
+                    VALUES (?, ?, ?, ?, TRUE)
+                """, (user_id, youtube_url, video_title, file_size))
+                
+                await db.execute("""
+                    UPDATE users 
+                    SET downloads_count = downloads_count + 1, last_activity = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                """, (user_id,))
+                
+                # Оба изменения фиксируются одним commit
+                await db.commit()
+                self.logger.info(f"Загрузка пользователя {user_id} записана в базу данных: {youtube_url}")
+                
+        except Exception as e:
+            self.logger.error(f"Ошибка при записи загрузки пользователя {user_id} в базу данных: {e}")
+    
+    async def get_cached_file(self, video_id: str, max_age: int) -> Optional[Tuple[str, str, int]]:
+        """Возвращает (file_id, название, размер) отправленного ранее аудио, если запись не устарела"""
+        try:
+            async with self.pool.connection() as db:
+                cursor = await db.execute("""
+                    SELECT telegram_file_id, video_title, file_size
+                    FROM cached_files
+                    WHERE video_id = ? AND cached_at >= datetime('now', ?)
+                """, (video_id, f"-{max_age} seconds"))
+                
+                return await cursor.fetchone()
+                
+        except Exception as e:
+            self.logger.error(f"Ошибка при получении кэшированного файла для видео {video_id}: {e}")
+            return None
+    
+    async def cache_file(self, video_id: str, telegram_file_id: str,
+                         video_title: Optional[str], file_size: int):
+        """Сохраняет file_id отправленного аудио для повторного использования"""
+        try:
+            async with self._write_lock, self.pool.connection() as db:
+                await db.execute("""
+                    INSERT INTO cached_files (video_id, telegram_file_id, video_title, file_size)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(video_id) DO UPDATE SET
+                        telegram_file_id = excluded.telegram_file_id,
+                        video_title = excluded.video_title,
+                        file_size = excluded.file_size,
+                        cached_at = CURRENT_TIMESTAMP
+                """, (video_id, telegram_file_id, video_title, file_size))
+                
+                await db.commit()
+                self.logger.debug(f"Файл для видео {video_id} сохранен в кэш")
+                
+        except Exception as e:
+            self.logger.error(f"Ошибка при сохранении кэшированного файла для видео {video_id}: {e}")
+    
     async def get_download_history(self, user_id: int, limit: int = 10) -> list:
         """Получает историю загрузок пользователя"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.connection() as db:
                 cursor = await db.execute("""
                     SELECT youtube_url, video_title, file_size, download_date, success
                     FROM downloads 
@@ -188,7 +285,7 @@ class DatabaseManager:
     async def get_admin_stats(self) -> Dict[str, Any]:
         """Получает общую статистику для администраторов"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.pool.connection() as db:
                 # Общее количество пользователей
                 cursor = await db.execute("SELECT COUNT(*) FROM users")
                 total_users = (await cursor.fetchone())[0]
@@ -215,6 +312,6 @@ class DatabaseManager:
             return {'total_users': 0, 'total_downloads': 0, 'active_users': 0}
     
     async def close(self):
-        """Закрывает соединение с базой данных"""
-        # В случае aiosqlite соединения закрываются автоматически
+        """Закрывает пул соединений с базой данных"""
+        await self.pool.close()
         self.logger.info("Соединение с базой данных закрыто") 
\ No newline at end of file
@@ -1,11 +1,21 @@
 import logging
 import logging.handlers
+import queue
 from pathlib import Path
+from typing import Optional
 from settings import settings
 
 
+# Фоновый обработчик очереди логов (запись на диск вне event loop)
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+
 def setup_logging():
     """Настраивает систему логгирования"""
+    global _queue_listener
+    
+    # Останавливаем предыдущий обработчик очереди при повторной настройке
+    stop_logging()
     
     # Создаем директорию для логов
     log_dir = Path("logs")
@@ -28,7 +38,6 @@ def setup_logging():
     console_handler = logging.StreamHandler()
     console_handler.setLevel(settings.get_log_level())
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
     
     # Обработчик для файла (с ротацией)
     file_handler = logging.handlers.RotatingFileHandler(
@@ -39,7 +48,6 @@ def setup_logging():
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
     
     # Отдельный файл для ошибок
     error_handler = logging.handlers.RotatingFileHandler(
@@ -50,7 +58,19 @@ def setup_logging():
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(formatter)
-    root_logger.addHandler(error_handler)
+    
+    # Логгеры только кладут записи в очередь, а запись в консоль и файлы
+    # (включая ротацию) выполняется в отдельном потоке
+    log_queue = queue.Queue(-1)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue,
+        console_handler,
+        file_handler,
+        error_handler,
+        respect_handler_level=True
+    )
+    _queue_listener.start()
     
     # Настройка логгеров внешних библиотек
     logging.getLogger("aiogram").setLevel(logging.WARNING)
@@ -60,6 +80,15 @@ def setup_logging():
     logging.info("Система логгирования настроена")
 
 
+def stop_logging():
+    """Останавливает фоновый обработчик очереди и дописывает оставшиеся записи"""
+    global _queue_listener
+    
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
 def get_logger(name: str) -> logging.Logger:
     """Возвращает настроенный логгер для указанного модуля"""
     return logging.getLogger(name) 
\ No newline at end of file
@@ -4,23 +4,17 @@ from pathlib import Path
 from typing import Optional
 
 from aiogram import Bot, Dispatcher
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.filters import Command
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
 from aiogram.client.session.aiohttp import AiohttpSession
-from aiogram.enums import ParseMode
+from aiogram.enums import ParseMode, ChatAction
+from aiogram.utils.chat_action import ChatActionSender
 
 from .youtube_downloader import YouTubeDownloader
 from .database import DatabaseManager
 from settings import settings
 
 
-class UserStates(StatesGroup):
-    """Состояния пользователя для FSM"""
-    waiting_for_url = State()
-
-
 class YouTubeAudioBot:
     """Основной класс Telegram бота для скачивания аудио из YouTube"""
     
@@ -44,13 +38,10 @@ class YouTubeAudioBot:
         self.dp.message.register(self._start_handler, Command("start"))
         self.dp.message.register(self._help_handler, Command("help"))
         self.dp.message.register(self._stats_handler, Command("stats"))
-        self.dp.message.register(self._url_handler, UserStates.waiting_for_url)
         self.dp.message.register(self._default_handler)
     
-    async def _start_handler(self, message: Message, state: FSMContext):
+    async def _start_handler(self, message: Message):
         """Обработчик команды /start"""
-        await state.clear()
-        
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📥 Скачать аудио", callback_data="download")],
             [InlineKeyboardButton(text="❓ Помощь", callback_data="help")],
@@ -62,7 +53,7 @@ class YouTubeAudioBot:
             "Привет! Я помогу тебе скачать аудио из YouTube видео.\n\n"
             "📋 <b>Что я умею:</b>\n"
             "• Скачивать аудио из YouTube видео\n"
-            "• Конвертировать в MP3 формат\n"
+            f"• Сохранять звук в формате {settings.AUDIO_FORMAT.upper()}\n"
             "• Отправлять готовый файл в Telegram\n\n"
             "Просто отправь мне ссылку на YouTube видео!"
         )
@@ -84,7 +75,7 @@ class YouTubeAudioBot:
             "❓ <b>Справка по использованию</b>\n\n"
             "🔹 Отправьте мне ссылку на YouTube видео\n"
             "🔹 Бот автоматически скачает аудио\n"
-            "🔹 Вы получите MP3 файл в личные сообщения\n\n"
+            f"🔹 Вы получите {settings.AUDIO_FORMAT.upper()} файл в личные сообщения\n\n"
             "📋 <b>Поддерживаемые форматы ссылок:</b>\n"
             "• https://www.youtube.com/watch?v=...\n"
             "• https://youtu.be/...\n"
@@ -107,115 +98,146 @@ class YouTubeAudioBot:
         
         stats_text = (
             f"📊 <b>Ваша статистика</b>\n\n"
-            f"🎵 Скачано файлов: {stats.get('downloads', 0)}\n"
-            f"📅 Дата регистрации: {stats.get('registration_date', 'Неизвестно')}\n"
-            f"⏰ Последняя активность: {stats.get('last_activity', 'Сейчас')}"
+            f"🎵 Скачано файлов: {stats.downloads}\n"
+            f"📅 Дата регистрации: {stats.registration_date}\n"
+            f"⏰ Последняя активность: {stats.last_activity}"
         )
         
         await message.answer(stats_text, parse_mode=ParseMode.HTML)
     
-    async def _url_handler(self, message: Message, state: FSMContext):
-        """Обработчик URL YouTube видео"""
-        url = message.text.strip()
-        
-        if not self.downloader.is_valid_youtube_url(url):
-            await message.answer(
-                "❌ Некорректная ссылка YouTube!\n\n"
-                "Пожалуйста, отправьте корректную ссылку на YouTube видео."
-            )
+    async def _process_url(self, message: Message, url: str):
+        """Скачивает аудио по проверенной ссылке и отправляет его пользователю"""
+        # Если это видео уже отправлялось, Telegram повторно использует загруженный файл
+        if await self._send_cached_audio(message, url):
             return
         
-        # Отправляем сообщение о начале обработки
-        processing_msg = await message.answer("⏳ Обрабатываю ваш запрос...")
-        
         try:
-            # Скачиваем аудио
-            audio_file_path = await self.downloader.download_audio(url)
-            
-            if audio_file_path == "TOO_LONG":
-                max_hours = settings.MAX_DURATION // 3600
-                await processing_msg.edit_text(
-                    "❌ Видео слишком длинное!\n\n"
-                    f"⏱️ Максимальная длительность: {max_hours} час(а)\n"
-                    "🎵 Попробуйте более короткое видео."
-                )
-                return
-            
-            if audio_file_path == "UNAVAILABLE":
-                await processing_msg.edit_text(
-                    "❌ Видео недоступно для скачивания!\n\n"
-                    "🚫 Возможные причины:\n"
-                    "• Видео заблокировано в вашем регионе\n"
-                    "• Автор ограничил скачивание\n"
-                    "• Видео было удалено\n\n"
-                    "🔄 Попробуйте другое видео."
-                )
-                return
-            
-            if audio_file_path == "AGE_RESTRICTED":
-                await processing_msg.edit_text(
-                    "❌ Видео ограничено по возрасту!\n\n"
-                    "🔞 Это видео имеет возрастные ограничения и не может быть скачано.\n\n"
-                    "🔄 Попробуйте другое видео."
-                )
-                return
-            
-            if audio_file_path == "PRIVATE":
-                await processing_msg.edit_text(
-                    "❌ Видео приватное!\n\n"
-                    "🔒 Это приватное видео недоступно для скачивания.\n\n"
-                    "🔄 Попробуйте публичное видео."
-                )
-                return
-            
-            if not audio_file_path or not Path(audio_file_path).exists():
-                await processing_msg.edit_text(
-                    "❌ Не удалось скачать аудио.\n"
-                    "Возможно, видео недоступно или превышен лимит размера."
-                )
-                return
-            
-            # Обновляем сообщение
-            await processing_msg.edit_text("📤 Отправляю аудио файл...")
-            
-            # Отправляем аудио файл
-            audio_file = Path(audio_file_path)
-            with open(audio_file, 'rb') as audio:
-                await message.answer_audio(
-                    audio=audio,
+            # Индикатор отправки аудио вместо служебного сообщения, которое
+            # потом пришлось бы редактировать и удалять
+            async with ChatActionSender(bot=self.bot, chat_id=message.chat.id,
+                                        action=ChatAction.UPLOAD_VOICE):
+                # Скачиваем аудио
+                result = await self.downloader.download_audio(url)
+                
+                if result == "TOO_LONG":
+                    max_hours = settings.MAX_DURATION // 3600
+                    await message.answer(
+                        "❌ Видео слишком длинное!\n\n"
+                        f"⏱️ Максимальная длительность: {max_hours} час(а)\n"
+                        "🎵 Попробуйте более короткое видео."
+                    )
+                    return
+                
+                if result == "TOO_BIG":
+                    await message.answer(
+                        "❌ Аудио получается слишком большим!\n\n"
+                        f"📦 Максимальный размер файла: {settings.MAX_FILE_SIZE} МБ\n"
+                        "🎵 Попробуйте более короткое видео."
+                    )
+                    return
+                
+                if result == "UNAVAILABLE":
+                    await message.answer(
+                        "❌ Видео недоступно для скачивания!\n\n"
+                        "🚫 Возможные причины:\n"
+                        "• Видео заблокировано в вашем регионе\n"
+                        "• Автор ограничил скачивание\n"
+                        "• Видео было удалено\n\n"
+                        "🔄 Попробуйте другое видео."
+                    )
+                    return
+                
+                if result == "AGE_RESTRICTED":
+                    await message.answer(
+                        "❌ Видео ограничено по возрасту!\n\n"
+                        "🔞 Это видео имеет возрастные ограничения и не может быть скачано.\n\n"
+                        "🔄 Попробуйте другое видео."
+                    )
+                    return
+                
+                if result == "PRIVATE":
+                    await message.answer(
+                        "❌ Видео приватное!\n\n"
+                        "🔒 Это приватное видео недоступно для скачивания.\n\n"
+                        "🔄 Попробуйте публичное видео."
+                    )
+                    return
+                
+                if not result:
+                    await message.answer(
+                        "❌ Не удалось скачать аудио.\n"
+                        "Попробуйте позже или отправьте другую ссылку."
+                    )
+                    return
+                
+                audio_file_path, info, file_size = result
+                
+                # Отправляем аудио файл
+                audio_file = Path(audio_file_path)
+                sent_msg = await message.answer_audio(
+                    audio=FSInputFile(str(audio_file)),
+                    # Метаданные известны заранее, Telegram не нужно анализировать файл
+                    duration=info['duration'],
+                    title=info['title'],
+                    performer="YouTube",
                     caption=f"🎵 Аудио из YouTube видео\n📎 {url}",
                     parse_mode=ParseMode.HTML
                 )
-            
-            # Удаляем временный файл
-            audio_file.unlink(missing_ok=True)
-            
-            # Удаляем сообщение о процессе
-            await processing_msg.delete()
-            
-            # Обновляем статистику
-            await self.db.increment_user_downloads(message.from_user.id)
-            
-            self.logger.info(f"Успешно обработан запрос от пользователя {message.from_user.id}")
+                
+                # Удаляем временный файл
+                await asyncio.to_thread(audio_file.unlink, missing_ok=True)
+                
+                # Обновляем статистику и историю загрузок
+                await self.db.record_successful_download(message.from_user.id, url, info['title'], file_size)
+                
+                # Запоминаем file_id для повторных запросов этого видео
+                if sent_msg.audio:
+                    await self.db.cache_file(info['video_id'], sent_msg.audio.file_id, info['title'], file_size)
+                
+                self.logger.info(f"Успешно обработан запрос от пользователя {message.from_user.id}")
             
         except Exception as e:
             self.logger.error(f"Ошибка при обработке URL {url}: {e}")
-            await processing_msg.edit_text(
+            await message.answer(
                 "❌ Произошла ошибка при обработке видео.\n"
                 "Пожалуйста, попробуйте позже или с другой ссылкой."
             )
+    
+    async def _send_cached_audio(self, message: Message, url: str) -> bool:
+        """Отправляет ранее загруженное в Telegram аудио по file_id, если оно есть в кэше"""
+        video_id = self.downloader.extract_video_id(url)
+        if not video_id:
+            return False
+        
+        cached = await self.db.get_cached_file(video_id, settings.FILE_CACHE_TTL)
+        if not cached:
+            return False
+        
+        file_id, title, file_size = cached
+        
+        try:
+            await message.answer_audio(
+                audio=file_id,
+                caption=f"🎵 Аудио из YouTube видео\n📎 {url}",
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e:
+            # Например, file_id стал недействительным — скачиваем заново
+            self.logger.warning(f"Не удалось отправить кэшированный файл для видео {video_id}: {e}")
+            return False
         
-        finally:
-            await state.clear()
+        await self.db.record_successful_download(message.from_user.id, url, title, file_size)
+        
+        self.logger.info(f"Пользователю {message.from_user.id} отправлен кэшированный файл для видео {video_id}")
+        return True
     
-    async def _default_handler(self, message: Message, state: FSMContext):
+    async def _default_handler(self, message: Message):
         """Обработчик для всех остальных сообщений"""
         text = message.text
         
         # Проверяем, является ли текст YouTube URL
         if self.downloader.is_valid_youtube_url(text):
-            await state.set_state(UserStates.waiting_for_url)
-            await self._url_handler(message, state)
+            await self._process_url(message, text.strip())
         else:
             await message.answer(
                 "🤔 Я не понимаю это сообщение.\n\n"
@@ -226,6 +248,7 @@ class YouTubeAudioBot:
         """Запускает бота в режиме polling"""
         try:
             self.logger.info("Запуск бота...")
+            await self.db.ensure_initialized()
             await self.dp.start_polling(self.bot)
         except Exception as e:
             self.logger.error(f"Ошибка при запуске бота: {e}")
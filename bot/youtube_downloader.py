@@ -2,16 +2,111 @@ import re
 import logging
 import asyncio
 from pathlib import Path
-from typing import Optional
-import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+import time
 import os
-from pytubefix import YouTube
-from pydub import AudioSegment
+from aiolimiter import AsyncLimiter
+from pytubefix import YouTube, Stream
+from pytubefix import request as yt_request
+from pytubefix.exceptions import (
+    AgeCheckRequiredAccountError,
+    AgeCheckRequiredError,
+    AgeRestrictedError,
+    BotDetection,
+    LoginRequired,
+    MaxRetriesExceeded,
+    VideoPrivate,
+    VideoUnavailable,
+)
 from settings import settings
 
-# Настройки для обхода блокировок
+# Настройки для обхода блокировок: SSL-контекст без проверки сертификата
+# используется только для запросов pytubefix, остальные HTTPS-соединения
+# процесса сохраняют проверку сертификатов
 import ssl
-ssl._create_default_https_context = ssl._create_unverified_context
+import socket
+import urllib.request
+from http.client import IncompleteRead
+from urllib.error import URLError
+_YT_SSL_CTX = ssl.create_default_context()
+_YT_SSL_CTX.check_hostname = False
+_YT_SSL_CTX.verify_mode = ssl.CERT_NONE
+
+# Таймаут (секунды) на подключение и каждое чтение из сокета при запросах к YouTube.
+# По умолчанию pytubefix ждет ответа бесконечно, и зависшее соединение навсегда
+# занимало бы одно из MAX_CONCURRENT_DOWNLOADS мест
+_YT_REQUEST_TIMEOUT = 30
+
+
+def _yt_urlopen(request, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, **kwargs):
+    """urlopen для pytubefix: SSL-контекст без проверки и таймаут для запросов без явного таймаута"""
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = _YT_REQUEST_TIMEOUT
+    return urllib.request.urlopen(request, timeout=timeout, context=_YT_SSL_CTX, **kwargs)
+
+
+yt_request.urlopen = _yt_urlopen
+
+# Скомпилированные регулярные выражения (проверяются на каждом сообщении)
+_YOUTUBE_URL_RE = re.compile(
+    r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+    r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+)
+
+# Различные форматы YouTube URL для извлечения ID видео
+_VIDEO_ID_PATTERNS = [
+    re.compile(r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]{11})'),
+    re.compile(r'youtube\.com/watch\?.*v=([a-zA-Z0-9_-]{11})'),
+]
+
+# Статусы ошибок для типизированных исключений pytubefix; подклассы, которых
+# нет в словаре (VideoRegionBlocked, MembersOnly и т.п.), ищутся по цепочке наследования.
+# Блокировка запросов со стороны YouTube временная и не говорит о самом видео,
+# поэтому для нее статуса нет (пользователь получит общее сообщение об ошибке)
+_ERROR_STATUSES = {
+    VideoUnavailable: "UNAVAILABLE",
+    AgeRestrictedError: "AGE_RESTRICTED",
+    AgeCheckRequiredError: "AGE_RESTRICTED",
+    AgeCheckRequiredAccountError: "AGE_RESTRICTED",
+    VideoPrivate: "PRIVATE",
+    BotDetection: None,
+    LoginRequired: None,
+}
+
+_ERROR_STATUS_MESSAGES = {
+    "UNAVAILABLE": "Видео недоступно для скачивания",
+    "AGE_RESTRICTED": "Видео ограничено по возрасту",
+    "PRIVATE": "Видео приватное",
+}
+
+# Файлы моложе этого возраста (секунды) не удаляются при очистке: они могут принадлежать активной загрузке
+_TEMP_FILE_MIN_AGE = 60
+
+# Сетевые ошибки при скачивании потока (включая HTTPError с кодами 403/404,
+# таймауты и оборванные ответы), после которых имеет смысл попробовать следующий поток
+_STREAM_ERRORS = (URLError, ConnectionError, TimeoutError, IncompleteRead, MaxRetriesExceeded)
+
+# Битрейт MP3 (кбит/с); используется и для оценки размера файла до кодирования
+_MP3_BITRATE_KBPS = 192
+
+# Сколько последних байт stderr ffmpeg сохранять для сообщения об ошибке
+_FFMPEG_STDERR_TAIL = 4096
+
+# Кэш объектов YouTube вместе с информацией о видео: время жизни записи короткое,
+# чтобы не устаревали подписанные ссылки на потоки
+_YT_CACHE_TTL = 300
+_YT_CACHE_MAXSIZE = 32
+
+
+def _stream_priority(stream: Stream) -> Tuple[bool, bool, int]:
+    """Ключ выбора аудио потока: только аудио, контейнер MP4, битрейт (кбит/с)"""
+    abr = (stream.abr or "").removesuffix("kbps")
+    return (
+        not stream.includes_video_track,
+        stream.subtype == "mp4",
+        int(abr) if abr.isdigit() else 0
+    )
 
 
 class YouTubeDownloader:
@@ -19,101 +114,168 @@ class YouTubeDownloader:
     
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
+        self._yt_cache: "OrderedDict[str, Tuple[float, Tuple[YouTube, dict]]]" = OrderedDict()
+        
+        # Ограничение одновременных обращений к YouTube и их частоты,
+        # чтобы избежать исчерпания пула потоков и ответов HTTP 429;
+        # ffmpeg запускается внутри загрузки, поэтому семафор ограничивает и число его процессов
+        self._download_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_DOWNLOADS)
+        self._rate_limiter = AsyncLimiter(settings.REQUESTS_PER_MINUTE, 60)
     
     def is_valid_youtube_url(self, url: str) -> bool:
         """Проверяет, является ли URL корректной ссылкой на YouTube"""
-        youtube_regex = re.compile(
-            r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
-            r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-        )
+        return _YOUTUBE_URL_RE.match(url) is not None
+    
+    def extract_video_id(self, url: str) -> Optional[str]:
+        """Извлекает 11-символьный ID видео из ссылки YouTube"""
+        for pattern in _VIDEO_ID_PATTERNS:
+            match = pattern.search(url)
+            if match:
+                return match.group(1)
         
-        return bool(youtube_regex.match(url))
+        return None
     
     def _clean_url(self, url: str) -> str:
         """Очищает URL от лишних параметров"""
         # Убираем все параметры кроме основного video ID
-        import re
-        
-        # Различные форматы YouTube URL
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]{11})',
-            r'youtube\.com/watch\?.*v=([a-zA-Z0-9_-]{11})',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                video_id = match.group(1)
-                return f"https://www.youtube.com/watch?v={video_id}"
+        video_id = self.extract_video_id(url)
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
         
         # Если паттерн не найден, возвращаем исходный URL
         return url
     
-    async def get_video_info(self, url: str) -> Optional[dict]:
-        """Получает информацию о видео без скачивания"""
+    @staticmethod
+    def _extract_info(yt: YouTube) -> dict:
+        """Собирает словарь с информацией о видео из объекта YouTube"""
+        return {
+            'title': yt.title,
+            'duration': yt.length,
+            'author': yt.author,
+            'video_id': yt.video_id,
+            'views': yt.views if hasattr(yt, 'views') else 0,
+            'description': yt.description[:500] if yt.description else "",
+            'age_restricted': yt.age_restricted if hasattr(yt, 'age_restricted') else False
+        }
+    
+    def _classify_error(self, url: str, e: Exception) -> Optional[str]:
+        """Определяет статус ошибки получения видео"""
+        for cls in type(e).__mro__:
+            if cls in _ERROR_STATUSES:
+                status = _ERROR_STATUSES[cls]
+                break
+        else:
+            # Нетипизированные ошибки разбираем по тексту сообщения
+            status = None
+            error_msg = str(e).lower()
+            if "unavailable" in error_msg:
+                status = "UNAVAILABLE"
+            elif "age" in error_msg or "restricted" in error_msg:
+                status = "AGE_RESTRICTED"
+            elif "private" in error_msg:
+                status = "PRIVATE"
+        
+        if status is None:
+            self.logger.error(f"Ошибка при получении информации о видео {url}: {e}")
+        else:
+            self.logger.error(f"{_ERROR_STATUS_MESSAGES[status]} {url}: {e}")
+        
+        return status
+    
+    @staticmethod
+    def _get_cached(cache: OrderedDict, url: str, ttl: int):
+        """Возвращает значение из кэша, если оно не устарело"""
+        cached = cache.get(url)
+        if not cached:
+            return None
+        
+        cached_at, value = cached
+        if time.monotonic() - cached_at > ttl:
+            del cache[url]
+            return None
+        
+        cache.move_to_end(url)
+        return value
+    
+    @staticmethod
+    def _put_cached(cache: OrderedDict, url: str, value, maxsize: int):
+        """Сохраняет значение в кэш, вытесняя самые старые записи"""
+        cache[url] = (time.monotonic(), value)
+        cache.move_to_end(url)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+    
+    async def _load_video(self, url: str) -> Union[Tuple[YouTube, dict], str, None]:
+        """Создает объект YouTube и получает информацию о видео за один вызов"""
+        # Повторный запрос того же видео (например, предпросмотр, затем скачивание)
+        # не загружает страницу и не расшифровывает подписи заново
+        cached = self._get_cached(self._yt_cache, url, _YT_CACHE_TTL)
+        if cached is not None:
+            return cached
+        
         try:
-            url = self._clean_url(url)
-            loop = asyncio.get_event_loop()
-            
-            def extract_info():
-                # Добавляем дополнительные параметры для обхода ограничений
-                yt = YouTube(
-                    url,
-                    use_oauth=False,
-                    allow_oauth_cache=False
-                )
+            loop = asyncio.get_running_loop()
+            
+            def load():
+                yt = YouTube(url)
                 
-                # Проверяем доступность видео
+                # Проверяем доступность видео: check_availability выбрасывает
+                # типизированное исключение pytubefix с причиной недоступности
+                yt.check_availability()
                 if not yt.title:
                     raise Exception("Видео недоступно или не найдено")
                 
-                return {
-                    'title': yt.title,
-                    'duration': yt.length,
-                    'author': yt.author,
-                    'video_id': yt.video_id,
-                    'views': yt.views if hasattr(yt, 'views') else 0,
-                    'description': yt.description[:500] if yt.description else "",
-                    'age_restricted': yt.age_restricted if hasattr(yt, 'age_restricted') else False
-                }
-            
-            info = await loop.run_in_executor(None, extract_info)
-            return info
+                return yt, self._extract_info(yt)
+            
+            yt, info = await loop.run_in_executor(None, load)
             
         except Exception as e:
-            error_msg = str(e).lower()
-            if "unavailable" in error_msg:
-                self.logger.error(f"Видео недоступно для скачивания {url}: {e}")
-                return "UNAVAILABLE"
-            elif "age" in error_msg or "restricted" in error_msg:
-                self.logger.error(f"Видео ограничено по возрасту {url}: {e}")
-                return "AGE_RESTRICTED"
-            elif "private" in error_msg:
-                self.logger.error(f"Видео приватное {url}: {e}")
-                return "PRIVATE"
-            else:
-                self.logger.error(f"Ошибка при получении информации о видео {url}: {e}")
-                return None
+            return self._classify_error(url, e)
+        
+        self._put_cached(self._yt_cache, url, (yt, info), _YT_CACHE_MAXSIZE)
+        return yt, info
+    
+    async def get_video_info(self, url: str) -> Optional[dict]:
+        """Получает информацию о видео без скачивания"""
+        url = self._clean_url(url)
+        
+        cached = self._get_cached(self._yt_cache, url, _YT_CACHE_TTL)
+        if cached is not None:
+            return cached[1]
+        
+        async with self._download_semaphore, self._rate_limiter:
+            result = await self._load_video(url)
+        
+        if isinstance(result, tuple):
+            return result[1]
+        return result
+    
+    async def download_audio(self, url: str) -> Union[Tuple[str, dict, int], str, None]:
+        """Скачивает аудио из YouTube видео и возвращает путь к файлу, информацию о видео и размер файла"""
+        async with self._download_semaphore, self._rate_limiter:
+            return await self._download_audio(url)
     
-    async def download_audio(self, url: str) -> Optional[str]:
-        """Скачивает аудио из YouTube видео и возвращает путь к файлу"""
+    async def _download_audio(self, url: str) -> Union[Tuple[str, dict, int], str, None]:
+        """Выполняет скачивание аудио (вызывается с учетом ограничений download_audio)"""
         try:
             url = self._clean_url(url)
             
-            # Получаем информацию о видео
-            info = await self.get_video_info(url)
-            if not info:
+            # Получаем объект видео и информацию о нем (один запрос к YouTube)
+            result = await self._load_video(url)
+            if not result:
                 self.logger.error(f"Не удалось получить информацию о видео: {url}")
                 return None
             
             # Обрабатываем специальные статусы ошибок
-            if info == "UNAVAILABLE":
+            if result == "UNAVAILABLE":
                 return "UNAVAILABLE"
-            elif info == "AGE_RESTRICTED":
+            elif result == "AGE_RESTRICTED":
                 return "AGE_RESTRICTED"
-            elif info == "PRIVATE":
+            elif result == "PRIVATE":
                 return "PRIVATE"
             
+            yt, info = result
+            
             # Проверяем длительность видео
             duration = info.get('duration', 0)
             if duration > settings.MAX_DURATION:
@@ -121,135 +283,250 @@ class YouTubeDownloader:
                 self.logger.warning(f"Видео слишком длинное ({duration} сек, лимит: {settings.MAX_DURATION} сек): {url}")
                 return "TOO_LONG"
             
-            # Скачиваем аудио
-            loop = asyncio.get_event_loop()
+            # Размер MP3 известен заранее, поэтому слишком большой файл отсекается
+            # еще до запроса списка потоков
+            if settings.AUDIO_FORMAT == "mp3" and self._mp3_exceeds_limit(duration, url):
+                return "TOO_BIG"
             
-            def download():
-                # Используем те же параметры что и в get_video_info
-                yt = YouTube(
-                    url,
-                    use_oauth=False,
-                    allow_oauth_cache=False
+            # Выбираем аудио поток
+            loop = asyncio.get_running_loop()
+            
+            def select_streams():
+                # Потоки с аудио по убыванию приоритета: только аудио, затем MP4, затем битрейт
+                return sorted(
+                    (stream for stream in yt.streams if stream.includes_audio_track),
+                    key=_stream_priority,
+                    reverse=True
                 )
-                
-                # Получаем аудио потоки (пробуем разные варианты)
-                audio_streams = [
-                    yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc(),
-                    yt.streams.filter(only_audio=True).order_by('abr').desc(),
-                    yt.streams.filter(adaptive=True, only_audio=True).order_by('abr').desc(),
-                    yt.streams.filter(file_extension='mp4').order_by('abr').desc()
-                ]
-                
-                audio_stream = None
-                for streams in audio_streams:
-                    if streams:
-                        audio_stream = streams.first()
-                        if audio_stream:
-                            break
-                
-                if not audio_stream:
-                    self.logger.error("Не удалось найти подходящий аудио поток")
-                    return None
-                
-                self.logger.info(f"Найден аудио поток: {audio_stream.mime_type}, качество: {getattr(audio_stream, 'abr', 'unknown')}")
-                
-                # Генерируем уникальное имя файла
-                unique_id = str(uuid.uuid4())[:8]
-                safe_title = re.sub(r'[^\w\s-]', '', info['title']).strip()[:50]
-                temp_filename = f"{safe_title}_{unique_id}"
-                
-                # Определяем расширение файла
-                file_extension = audio_stream.mime_type.split('/')[-1] if audio_stream.mime_type else 'mp4'
-                
-                # Скачиваем во временную директорию
-                temp_path = settings.TEMP_DIR / f"{temp_filename}.{file_extension}"
-                
-                self.logger.info(f"Начинаем скачивание: {temp_filename}.{file_extension}")
-                audio_stream.download(output_path=str(settings.TEMP_DIR), filename=f"{temp_filename}.{file_extension}")
-                
-                return str(temp_path)
             
-            temp_file_path = await loop.run_in_executor(None, download)
+            candidate_streams = await loop.run_in_executor(None, select_streams)
             
-            if not temp_file_path or not Path(temp_file_path).exists():
-                self.logger.error("Не удалось скачать аудио файл")
+            if not candidate_streams:
+                self._yt_cache.pop(url, None)
+                self.logger.error("Не удалось найти подходящий аудио поток")
                 return None
             
-            # Конвертируем в MP3
-            mp3_file_path = await self._convert_to_mp3(temp_file_path, info['title'])
-            
-            # Удаляем временный файл
-            try:
-                Path(temp_file_path).unlink(missing_ok=True)
-            except Exception:
-                pass
+            audio_file_path = None
+            for audio_stream in candidate_streams:
+                self.logger.info(f"Найден аудио поток: {audio_stream.mime_type}, качество: {getattr(audio_stream, 'abr', 'unknown')}")
+                
+                try:
+                    if settings.AUDIO_FORMAT == "m4a" and audio_stream.mime_type == "audio/mp4":
+                        # AAC-поток в контейнере MP4 сохраняется как есть, без перекодирования
+                        audio_file_path = await self._download_m4a(audio_stream, info['title'])
+                    else:
+                        # Поток без AAC в режиме m4a тоже кодируется в MP3 - проверяем его размер
+                        if settings.AUDIO_FORMAT != "mp3" and self._mp3_exceeds_limit(duration, url):
+                            return "TOO_BIG"
+                        
+                        # Поток скачивается сразу в ffmpeg и кодируется в MP3
+                        audio_file_path = await self._convert_to_mp3(audio_stream, info['title'])
+                    break
+                    
+                except _STREAM_ERRORS as e:
+                    # Ссылка на поток могла устареть (например, 403 от googlevideo) - пробуем следующий,
+                    # а закэшированный объект YouTube с устаревшими ссылками больше не используем
+                    self._yt_cache.pop(url, None)
+                    self.logger.warning(f"Не удалось скачать поток {audio_stream.itag}, пробуем следующий: {e}")
             
-            if mp3_file_path and Path(mp3_file_path).exists():
+            if audio_file_path:
                 # Проверяем размер файла
-                file_size = Path(mp3_file_path).stat().st_size
+                try:
+                    file_size = await asyncio.to_thread(os.path.getsize, audio_file_path)
+                except OSError:
+                    self._yt_cache.pop(url, None)
+                    return None
+                
                 if file_size > settings.MAX_FILE_SIZE * 1024 * 1024:
                     self.logger.warning(f"Скачанный файл превышает лимит размера: {file_size} байт")
-                    Path(mp3_file_path).unlink(missing_ok=True)
-                    return None
+                    await asyncio.to_thread(Path(audio_file_path).unlink, missing_ok=True)
+                    return "TOO_BIG"
                 
-                self.logger.info(f"Успешно скачан файл: {mp3_file_path}")
-                return mp3_file_path
+                self.logger.info(f"Успешно скачан файл: {audio_file_path}")
+                return audio_file_path, info, file_size
             
+            self._yt_cache.pop(url, None)
             return None
             
         except Exception as e:
+            self._yt_cache.pop(url, None)
             self.logger.error(f"Ошибка при скачивании аудио из {url}: {e}")
             return None
     
-    async def _convert_to_mp3(self, input_path: str, title: str) -> Optional[str]:
-        """Конвертирует аудио файл в MP3 формат"""
+    def _mp3_exceeds_limit(self, duration: int, url: str) -> bool:
+        """Проверяет, превысит ли MP3 лимит размера (оценка по длительности и битрейту)"""
+        estimated_size = duration * _MP3_BITRATE_KBPS * 1000 // 8
+        if estimated_size > settings.MAX_FILE_SIZE * 1024 * 1024:
+            self.logger.warning(f"Ожидаемый размер файла превышает лимит ({estimated_size} байт): {url}")
+            return True
+        
+        return False
+    
+    def _make_output_path(self, extension: str) -> Path:
+        """Генерирует уникальный путь к файлу во временной директории"""
+        # Имя файла случайное: название видео хранится только в тегах и метаданных Telegram
+        return settings.TEMP_DIR / f"{os.urandom(8).hex()}.{extension}"
+    
+    async def _download_m4a(self, audio_stream: Stream, title: str) -> Optional[str]:
+        """Скачивает AAC-поток в файл .m4a без перекодирования (сетевые ошибки пробрасываются)"""
+        output_path = self._make_output_path("m4a")
+        success = False
+        
         try:
-            loop = asyncio.get_event_loop()
-            
-            def convert():
-                # Генерируем имя выходного файла
-                unique_id = str(uuid.uuid4())[:8]
-                safe_title = re.sub(r'[^\w\s-]', '', title).strip()[:50]
-                output_filename = f"{safe_title}_{unique_id}.mp3"
-                output_path = settings.TEMP_DIR / output_filename
-                
-                # Конвертируем с помощью pydub
-                audio = AudioSegment.from_file(input_path)
-                
-                # Настройки качества
-                audio = audio.set_frame_rate(44100)
-                audio = audio.set_channels(2)
-                
-                # Экспортируем в MP3
-                audio.export(
-                    str(output_path),
-                    format="mp3",
-                    bitrate="192k",
-                    tags={
-                        'title': title,
-                        'artist': 'YouTube',
-                        'album': 'YouTube Audio Bot'
-                    }
+            self.logger.info(f"Начинаем скачивание: {title} -> {output_path.name}")
+            
+            def download():
+                audio_stream.download(
+                    output_path=str(output_path.parent),
+                    filename=output_path.name,
+                    timeout=_YT_REQUEST_TIMEOUT
                 )
                 
-                return str(output_path)
+                # pytubefix молча проглатывает HTTP 404, оставляя пустой или обрезанный файл,
+                # поэтому сверяем записанный размер с размером потока
+                written = output_path.stat().st_size if output_path.exists() else 0
+                if written != audio_stream.filesize:
+                    raise URLError(f"получено {written} из {audio_stream.filesize} байт")
             
-            result = await loop.run_in_executor(None, convert)
-            return result
+            await asyncio.get_running_loop().run_in_executor(None, download)
+            success = True
+            return str(output_path)
             
         except Exception as e:
+            if isinstance(e, _STREAM_ERRORS):
+                raise
+            self.logger.error(f"Ошибка при скачивании аудио файла: {e}")
+            return None
+        
+        finally:
+            # Выполняется и при отмене задачи: CancelledError не наследуется от Exception
+            if not success:
+                await asyncio.to_thread(output_path.unlink, missing_ok=True)
+    
+    async def _convert_to_mp3(self, audio_stream: Stream, title: str) -> Optional[str]:
+        """Скачивает аудио поток напрямую в ffmpeg и кодирует его в MP3 (сетевые ошибки пробрасываются)"""
+        output_path = self._make_output_path("mp3")
+        proc = None
+        stderr_task = None
+        success = False
+        
+        try:
+            loop = asyncio.get_running_loop()
+            self.logger.info(f"Начинаем скачивание: {title} -> {output_path.name}")
+            
+            # Данные из HTTP-ответа передаются в stdin ffmpeg без промежуточного файла;
+            # частота и число каналов сохраняются как в источнике (без ресемплинга)
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-vn", "-c:a", "libmp3lame", "-b:a", f"{_MP3_BITRATE_KBPS}k",
+                "-f", "mp3",
+                # Кодирование прерывается, как только файл превысит лимит
+                # (на 1 байт больше лимита, чтобы проверка размера это заметила)
+                "-fs", str(settings.MAX_FILE_SIZE * 1024 * 1024 + 1),
+                "-metadata", f"title={title}",
+                "-metadata", "artist=YouTube",
+                "-metadata", "album=YouTube Audio Bot",
+                str(output_path),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            
+            # stderr читается параллельно с записью в stdin: если ffmpeg выведет больше
+            # буфера канала (например, по строке на каждый битый кадр), он заблокируется
+            # на записи в stderr, перестанет читать stdin, и drain() будет ждать вечно
+            stderr_task = asyncio.create_task(self._read_tail(proc.stderr, _FFMPEG_STDERR_TAIL))
+            
+            # Генератор pytubefix блокирующий, поэтому каждый фрагмент читается в пуле потоков
+            chunks = yt_request.stream(audio_stream.url, timeout=_YT_REQUEST_TIMEOUT)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                    if chunk is None:
+                        break
+                    
+                    try:
+                        proc.stdin.write(chunk)
+                        await proc.stdin.drain()
+                    except (BrokenPipeError, ConnectionResetError):
+                        # ffmpeg завершился раньше времени, причина будет в stderr
+                        break
+            finally:
+                # Закрываем генератор, чтобы освободить HTTP-ответ pytubefix
+                # (ValueError - генератор еще выполняется в потоке при отмене задачи)
+                try:
+                    chunks.close()
+                except ValueError:
+                    pass
+            
+            # Закрываем stdin, чтобы ffmpeg получил EOF и завершил кодирование
+            proc.stdin.close()
+            try:
+                await proc.stdin.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            
+            stderr = await stderr_task
+            await proc.wait()
+            
+            if proc.returncode != 0:
+                self.logger.error(f"ffmpeg завершился с кодом {proc.returncode}: {stderr.decode(errors='replace').strip()}")
+                return None
+            
+            success = True
+            return str(output_path)
+            
+        except Exception as e:
+            if isinstance(e, _STREAM_ERRORS):
+                raise
             self.logger.error(f"Ошибка при конвертации в MP3: {e}")
             return None
+        
+        finally:
+            # Выполняется и при отмене задачи (CancelledError не наследуется от Exception),
+            # чтобы ffmpeg не остался висеть на открытом stdin, а неполный MP3 - в TEMP_DIR
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if stderr_task is not None:
+                stderr_task.cancel()
+            if not success:
+                await asyncio.to_thread(output_path.unlink, missing_ok=True)
     
-    def cleanup_temp_files(self):
+    @staticmethod
+    async def _read_tail(stream: asyncio.StreamReader, limit: int) -> bytes:
+        """Читает поток до конца, сохраняя только последние limit байт"""
+        tail = b""
+        while chunk := await stream.read(limit):
+            tail = (tail + chunk)[-limit:]
+        
+        return tail
+    
+    def _cleanup_sync(self):
+        """Удаляет файлы из временной директории (выполняется в отдельном потоке)"""
+        if not settings.TEMP_DIR.exists():
+            return
+        
+        now = time.time()
+        
+        # os.scandir отдает тип файла без отдельного stat на каждую запись
+        with os.scandir(settings.TEMP_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                
+                try:
+                    if now - entry.stat(follow_symlinks=False).st_mtime < _TEMP_FILE_MIN_AGE:
+                        continue
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+    
+    async def cleanup_temp_files(self):
         """Очищает временные файлы"""
         try:
-            temp_dir = Path(settings.TEMP_DIR)
-            if temp_dir.exists():
-                for file in temp_dir.iterdir():
-                    if file.is_file():
-                        file.unlink()
-                        
-                self.logger.info("Временные файлы очищены")
+            await asyncio.to_thread(self._cleanup_sync)
+            self.logger.info("Временные файлы очищены")
         except Exception as e:
-            self.logger.error(f"Ошибка при очистке временных файлов: {e}") 
\ No newline at end of file
+            self.logger.error(f"Ошибка при очистке временных файлов: {e}")
@@ -2,10 +2,12 @@ import asyncio
 import logging
 import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from bot.logger import setup_logging
+from bot.logger import setup_logging, stop_logging
 from bot.youtube_audio_bot import YouTubeAudioBot
+from settings import settings
 
 
 class BotApplication:
@@ -30,6 +32,11 @@ class BotApplication:
             self.logger.info("Запуск YouTube Audio Bot")
             self.logger.info("=" * 50)
             
+            # Пул потоков для блокирующих операций (pytubefix, файловая система)
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=settings.THREAD_POOL_SIZE, thread_name_prefix="bot-worker")
+            )
+            
             # Создаем и запускаем бота
             self.bot = YouTubeAudioBot()
             
@@ -59,12 +66,15 @@ class BotApplication:
         
         if self.logger:
             self.logger.info("Бот остановлен")
+        
+        # Дописываем оставшиеся записи логов
+        stop_logging()
     
     def _setup_signal_handlers(self):
         """Настраивает обработчики сигналов для корректного завершения"""
         if sys.platform != 'win32':
             # Unix-системы
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             
             def signal_handler():
                 self.logger.info("Получен сигнал завершения")
@@ -1,5 +1,6 @@
 import os
 import logging
+from functools import lru_cache
 from typing import List
 from pathlib import Path
 
@@ -20,6 +21,15 @@ class Settings:
         self.MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "50"))  # MB
         self.MAX_DURATION: int = int(os.getenv("MAX_DURATION", "14400"))  # секунды (4 часа)
         self.TEMP_DIR: Path = Path("temp")
+        self.AUDIO_FORMAT: str = os.getenv("AUDIO_FORMAT", "mp3").lower()  # mp3 или m4a
+        self.MAX_CONCURRENT_DOWNLOADS: int = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4"))
+        self.REQUESTS_PER_MINUTE: int = int(os.getenv("REQUESTS_PER_MINUTE", "30"))  # запросов к YouTube
+        # Каждая активная загрузка занимает поток пула на время чтения из сети, поэтому
+        # для них резервируются MAX_CONCURRENT_DOWNLOADS потоков сверх стандартного min(32, ядра + 4)
+        self.THREAD_POOL_SIZE: int = int(os.getenv(
+            "THREAD_POOL_SIZE", str(self.MAX_CONCURRENT_DOWNLOADS + min(32, (os.cpu_count() or 1) + 4))
+        ))
+        self.FILE_CACHE_TTL: int = int(os.getenv("FILE_CACHE_TTL", "604800"))  # секунды (7 дней)
         
         # Настройки базы данных
         self.DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///bot.db")
@@ -54,10 +64,26 @@ class Settings:
         
         if self.LOG_LEVEL not in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
             self.LOG_LEVEL = "INFO"
+        
+        if self.AUDIO_FORMAT not in ["mp3", "m4a"]:
+            self.AUDIO_FORMAT = "mp3"
     
     def get_log_level(self) -> int:
         """Возвращает числовое значение уровня логгирования"""
         return getattr(logging, self.LOG_LEVEL)
 
-# Глобальный экземпляр настроек
-settings = Settings() 
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Создает настройки при первом обращении и возвращает один и тот же экземпляр"""
+    return Settings()
+
+
+class _LazySettings:
+    """Откладывает создание Settings до первого обращения к атрибуту"""
+    
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+
+# Глобальный экземпляр настроек (создается лениво, при первом обращении)
+settings = _LazySettings()